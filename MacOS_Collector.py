@@ -1,425 +1,1358 @@
-#!/usr/bin/env python3
-"""
-Forensic Sparsebundle Creator
-
-This script allows users to select files and folders, creates a sparsebundle,
-mounts it, and copies the selected items while preserving metadata.
-Designed for MacOS with forensic best practices in mind.
-"""
-
-import os
-import sys
-import subprocess
-import shutil
-import datetime
-import logging
-import hashlib
-import plistlib
-import time
-import uuid
-from pathlib import Path
-import tkinter as tk
-from tkinter import filedialog
-
-# Configure logging
-log_dir = os.path.expanduser("~/forensic_logs")
-os.makedirs(log_dir, exist_ok=True)
-log_file = os.path.join(log_dir, f"forensic_sparsebundle_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - [%(funcName)s] - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-logger = logging.getLogger(__name__)
-
-def log_system_info():
-    """Log system information for forensic documentation."""
-    logger.info("=== System Information ===")
-    try:
-        logger.info(f"User: {subprocess.check_output('whoami', text=True).strip()}")
-        logger.info(f"Hostname: {subprocess.check_output('hostname', text=True).strip()}")
-        logger.info(f"macOS Version: {subprocess.check_output(['sw_vers', '-productVersion'], text=True).strip()}")
-        logger.info(f"Build Version: {subprocess.check_output(['sw_vers', '-buildVersion'], text=True).strip()}")
-        logger.info(f"Architecture: {subprocess.check_output(['uname', '-m'], text=True).strip()}")
-        logger.info(f"Kernel Version: {subprocess.check_output(['uname', '-r'], text=True).strip()}")
-        logger.info(f"Current Time: {datetime.datetime.now().isoformat()}")
-        logger.info(f"Tool Version: Forensic Sparsebundle Creator 1.0.0")
-    except subprocess.SubprocessError as e:
-        logger.error(f"Error getting system information: {e}")
-
-def calculate_hash(file_path, algorithm='sha256'):
-    """Calculate hash for a file using the specified algorithm."""
-    try:
-        hash_obj = hashlib.new(algorithm)
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b''):
-                hash_obj.update(chunk)
-        return hash_obj.hexdigest()
-    except Exception as e:
-        logger.error(f"Error calculating hash for {file_path}: {e}")
-        return None
-
-def execute_command(cmd, description):
-    """Execute a shell command and log the output."""
-    logger.info(f"Executing: {description}")
-    logger.debug(f"Command: {' '.join(cmd)}")
-    try:
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        stdout, stderr = process.communicate()
-        
-        if process.returncode != 0:
-            logger.error(f"{description} failed with code {process.returncode}")
-            logger.error(f"Error output: {stderr.strip()}")
-            return False, stderr
-        
-        logger.debug(f"Output: {stdout.strip()}")
-        return True, stdout
-    except Exception as e:
-        logger.error(f"Exception while {description}: {e}")
-        return False, str(e)
-
-def create_sparsebundle(destination_path, name, size_mb=10240):
-    """Create a sparsebundle with the given name and size."""
-    logger.info(f"Creating sparsebundle: {name} with size: {size_mb}MB")
-    
-    sparsebundle_path = os.path.join(destination_path, f"{name}.sparsebundle")
-    
-    if os.path.exists(sparsebundle_path):
-        logger.warning(f"Sparsebundle already exists at {sparsebundle_path}")
-        return False, sparsebundle_path
-    
-    cmd = [
-        'hdiutil', 'create',
-        '-size', f'{size_mb}m',
-        '-fs', 'HFS+',
-        '-volname', name,
-        '-type', 'SPARSEBUNDLE',
-        '-encryption', 'AES-256',
-        sparsebundle_path
-    ]
-    
-    success, output = execute_command(cmd, "Creating sparsebundle")
-    return success, sparsebundle_path
-
-def mount_sparsebundle(sparsebundle_path):
-    """Mount the sparsebundle and return the mount point."""
-    logger.info(f"Mounting sparsebundle: {sparsebundle_path}")
-    
-    cmd = ['hdiutil', 'attach', sparsebundle_path, '-mountpoint', '/Volumes/ForensicData']
-    success, output = execute_command(cmd, "Mounting sparsebundle")
-    
-    if success:
-        # Find the mount point from output
-        mount_point = '/Volumes/ForensicData'
-        logger.info(f"Sparsebundle mounted at: {mount_point}")
-        return True, mount_point
-    else:
-        return False, None
-
-def unmount_sparsebundle(mount_point):
-    """Unmount the sparsebundle."""
-    logger.info(f"Unmounting sparsebundle from: {mount_point}")
-    
-    cmd = ['hdiutil', 'detach', mount_point, '-force']
-    success, output = execute_command(cmd, "Unmounting sparsebundle")
-    return success
-
-def copy_with_metadata(source, destination, hash_log):
-    """Copy files/folders preserving metadata and log file hashes."""
-    logger.info(f"Copying: {source} -> {destination}")
-    
-    try:
-        if os.path.isfile(source):
-            # For files, use ditto to preserve all metadata
-            cmd = ['ditto', '-v', source, destination]
-            success, output = execute_command(cmd, f"Copying file {source}")
-            
-            if success:
-                # Calculate and log hash
-                source_hash = calculate_hash(source)
-                dest_hash = calculate_hash(os.path.join(destination, os.path.basename(source)) 
-                                         if os.path.isdir(destination) else destination)
-                
-                hash_entry = {
-                    'source_path': source,
-                    'destination_path': destination,
-                    'sha256_source': source_hash,
-                    'sha256_destination': dest_hash,
-                    'timestamp': datetime.datetime.now().isoformat()
-                }
-                hash_log.append(hash_entry)
-                
-                if source_hash != dest_hash:
-                    logger.error(f"Hash mismatch for {source}!")
-                    logger.error(f"Source: {source_hash}")
-                    logger.error(f"Destination: {dest_hash}")
-                    return False
-            else:
-                return False
-                
-        elif os.path.isdir(source):
-            # For directories, create destination directory first
-            dest_dir = os.path.join(destination, os.path.basename(source))
-            os.makedirs(dest_dir, exist_ok=True)
-            
-            # Use ditto to copy the entire directory with metadata
-            cmd = ['ditto', '-v', source, dest_dir]
-            success, output = execute_command(cmd, f"Copying directory {source}")
-            
-            if not success:
-                return False
-        
-        return True
-    except Exception as e:
-        logger.error(f"Error copying {source}: {e}")
-        return False
-
-def select_files_and_folders():
-    """Open a file dialog for selecting multiple files and folders."""
-    logger.info("Prompting user to select files and folders")
-    
-    root = tk.Tk()
-    root.withdraw()  # Hide the main window
-    
-    # Inform the user about the selection process
-    logger.info("Please select files and folders to include in the sparsebundle")
-    
-    # First, select files (can select multiple at once)
-    files = list(filedialog.askopenfilenames(
-        title="Select files to include in sparsebundle (or cancel if selecting folders only)",
-        multiple=True
-    ))
-    
-    # Then ask if user wants to select folders
-    folders = []
-    select_folders = tk.messagebox.askyesno(
-        "Select Folders",
-        "Would you like to select folders as well?"
-    )
-    
-    # If yes, allow folder selection
-    if select_folders:
-        # Create a custom dialog for folder selection with a "Done" button
-        folder_select_window = tk.Toplevel(root)
-        folder_select_window.title("Select Folders")
-        folder_select_window.geometry("500x300")
-        
-        tk.Label(folder_select_window, 
-                text="Click 'Select Folder' to add folders to the selection.\nClick 'Done' when finished.",
-                pady=10).pack()
-        
-        selected_folders_listbox = tk.Listbox(folder_select_window, width=60, height=10)
-        selected_folders_listbox.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
-        
-        buttons_frame = tk.Frame(folder_select_window)
-        buttons_frame.pack(pady=10)
-        
-        def add_folder():
-            folder_path = filedialog.askdirectory(
-                title="Select a folder to include",
-                parent=folder_select_window
-            )
-            if folder_path:
-                folders.append(folder_path)
-                selected_folders_listbox.insert(tk.END, folder_path)
-        
-        def finish_selection():
-            folder_select_window.destroy()
-        
-        tk.Button(buttons_frame, text="Select Folder", command=add_folder).pack(side=tk.LEFT, padx=5)
-        tk.Button(buttons_frame, text="Done", command=finish_selection).pack(side=tk.LEFT, padx=5)
-        
-        # Wait for this window to be closed before continuing
-        root.wait_window(folder_select_window)
-    
-    root.destroy()
-    
-    all_paths = files + folders
-    if not all_paths:
-        logger.warning("No files or folders were selected")
-    else:
-        logger.info(f"Selected {len(files)} files and {len(folders)} folders")
-        for path in all_paths:
-            logger.info(f"Selected: {path}")
-    
-    return all_paths
-
-def estimate_size_needed(paths):
-    """Estimate the size needed for the sparsebundle."""
-    logger.info("Estimating size needed for selected files and folders")
-    
-    total_size = 0
-    for path in paths:
-        try:
-            if os.path.isfile(path):
-                total_size += os.path.getsize(path)
-            elif os.path.isdir(path):
-                for dirpath, dirnames, filenames in os.walk(path):
-                    for f in filenames:
-                        fp = os.path.join(dirpath, f)
-                        if os.path.exists(fp):
-                            total_size += os.path.getsize(fp)
-        except Exception as e:
-            logger.error(f"Error calculating size for {path}: {e}")
-    
-    # Convert to MB and add 10% buffer
-    size_mb = int((total_size / (1024 * 1024)) * 1.1)
-    
-    # Ensure minimum size of 100MB
-    size_mb = max(size_mb, 100)
-    
-    logger.info(f"Estimated size needed: {size_mb}MB")
-    return size_mb
-
-def create_verification_report(hash_log, output_path, sparsebundle_path):
-    """Create a verification report with all file hashes and operations."""
-    logger.info("Creating verification report")
-    
-    report_path = os.path.join(output_path, "verification_report.plist")
-    
-    report_data = {
-        'timestamp': datetime.datetime.now().isoformat(),
-        'sparsebundle_path': sparsebundle_path,
-        'tool_version': "Forensic Sparsebundle Creator 1.0.0",
-        'system_info': {
-            'user': subprocess.check_output('whoami', text=True).strip(),
-            'hostname': subprocess.check_output('hostname', text=True).strip(),
-            'macos_version': subprocess.check_output(['sw_vers', '-productVersion'], text=True).strip(),
-        },
-        'file_hashes': hash_log
-    }
-    
-    try:
-        with open(report_path, 'wb') as f:
-            plistlib.dump(report_data, f)
-        
-        logger.info(f"Verification report created at: {report_path}")
-        
-        # Also create a text version
-        txt_report_path = os.path.join(output_path, "verification_report.txt")
-        with open(txt_report_path, 'w') as f:
-            f.write(f"FORENSIC SPARSEBUNDLE VERIFICATION REPORT\n")
-            f.write(f"=====================================\n\n")
-            f.write(f"Created: {report_data['timestamp']}\n")
-            f.write(f"Sparsebundle: {report_data['sparsebundle_path']}\n")
-            f.write(f"Tool Version: {report_data['tool_version']}\n\n")
-            
-            f.write(f"SYSTEM INFORMATION\n")
-            f.write(f"-----------------\n")
-            for k, v in report_data['system_info'].items():
-                f.write(f"{k}: {v}\n")
-            
-            f.write(f"\nFILE HASHES\n")
-            f.write(f"-----------\n")
-            for entry in hash_log:
-                f.write(f"Source: {entry['source_path']}\n")
-                f.write(f"Destination: {entry['destination_path']}\n")
-                f.write(f"Source SHA256: {entry['sha256_source']}\n")
-                f.write(f"Destination SHA256: {entry['sha256_destination']}\n")
-                f.write(f"Match: {entry['sha256_source'] == entry['sha256_destination']}\n")
-                f.write(f"Timestamp: {entry['timestamp']}\n\n")
-        
-        logger.info(f"Text verification report created at: {txt_report_path}")
-        
-    except Exception as e:
-        logger.error(f"Error creating verification report: {e}")
-
-def main():
-    """Main function for the forensic sparsebundle creator."""
-    try:
-        logger.info("=== Forensic Sparsebundle Creator Started ===")
-        log_system_info()
-        
-        # Check if running on macOS
-        if sys.platform != 'darwin':
-            logger.error("This script is designed to run only on macOS")
-            return 1
-        
-        # Select files and folders
-        selected_paths = select_files_and_folders()
-        if not selected_paths:
-            logger.error("No files or folders were selected. Exiting.")
-            return 1
-        
-        # Get size estimate
-        size_needed = estimate_size_needed(selected_paths)
-        
-        # Get destination for sparsebundle
-        root = tk.Tk()
-        root.withdraw()
-        destination_path = filedialog.askdirectory(
-            title="Select where to save the sparsebundle"
-        )
-        root.destroy()
-        
-        if not destination_path:
-            logger.error("No destination selected. Exiting.")
-            return 1
-        
-        # Generate a unique name for the sparsebundle
-        sparsebundle_name = f"ForensicData_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-        # Create sparsebundle
-        success, sparsebundle_path = create_sparsebundle(destination_path, sparsebundle_name, size_needed)
-        if not success:
-            logger.error("Failed to create sparsebundle. Exiting.")
-            return 1
-        
-        # Mount sparsebundle
-        success, mount_point = mount_sparsebundle(sparsebundle_path)
-        if not success:
-            logger.error("Failed to mount sparsebundle. Exiting.")
-            return 1
-        
-        # Create a log directory inside the sparsebundle
-        log_dir_in_sparsebundle = os.path.join(mount_point, "forensic_logs")
-        os.makedirs(log_dir_in_sparsebundle, exist_ok=True)
-        
-        # Copy log file to the sparsebundle
-        shutil.copy2(log_file, log_dir_in_sparsebundle)
-        
-        # Create a directory for copied files
-        files_dir = os.path.join(mount_point, "copied_files")
-        os.makedirs(files_dir, exist_ok=True)
-        
-        # Copy files and folders while preserving metadata
-        hash_log = []
-        success = True
-        for path in selected_paths:
-            if not copy_with_metadata(path, files_dir, hash_log):
-                logger.error(f"Failed to copy {path}")
-                success = False
-        
-        # Create verification report
-        create_verification_report(hash_log, log_dir_in_sparsebundle, sparsebundle_path)
-        
-        # Unmount sparsebundle
-        if not unmount_sparsebundle(mount_point):
-            logger.error("Failed to unmount sparsebundle properly")
-            return 1
-        
-        if success:
-            logger.info("=== Forensic Sparsebundle Creator Completed Successfully ===")
-            logger.info(f"Sparsebundle created at: {sparsebundle_path}")
-            logger.info(f"Log file: {log_file}")
-            return 0
-        else:
-            logger.error("=== Forensic Sparsebundle Creator Completed with Errors ===")
-            return 1
-            
-    except Exception as e:
-        logger.critical(f"Unhandled exception: {e}", exc_info=True)
-        return 1
-
-if __name__ == "__main__":
+#!/usr/bin/env python3
+"""
+Forensic Sparsebundle Creator
+
+This script allows users to select files and folders, creates a sparsebundle,
+mounts it, and copies the selected items while preserving metadata.
+Designed for MacOS with forensic best practices in mind.
+"""
+
+import os
+import sys
+import argparse
+import contextlib
+import fcntl
+import functools
+import subprocess
+import shutil
+import datetime
+import ctypes
+import logging
+import logging.handlers
+import hashlib
+import json
+import mmap
+import platform
+import plistlib
+import pwd
+import re
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import multiprocessing
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor, wait,
+                                as_completed, FIRST_COMPLETED)
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+import tkinter as tk
+from tkinter import filedialog
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+# Configure logging
+log_dir = os.path.expanduser("~/forensic_logs")
+os.makedirs(log_dir, exist_ok=True)
+log_file = os.path.join(log_dir, f"forensic_sparsebundle_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+
+# Set up logging (only in the main process; hashing workers re-import this module)
+if multiprocessing.parent_process() is None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - [%(funcName)s] - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+logger = logging.getLogger(__name__)
+
+# Read size used when hashing files without hashlib.file_digest
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Number of threads copying selected items
+COPY_WORKERS = 4
+
+# Number of worker processes used to hash copied files
+HASH_WORKERS = os.cpu_count() or 4
+
+# Maximum number of copied files waiting for or being hashed
+HASH_QUEUE_DEPTH = 2 * HASH_WORKERS
+
+# BLAKE3 is preferred when the blake3 package is installed
+DEFAULT_HASH_ALGORITHM = 'blake3' if blake3 is not None else 'sha256'
+
+# Buffer size used when copying and hashing files in a single pass
+COPY_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Files at least this large bypass the page cache by default (--no-cache auto)
+NOCACHE_THRESHOLD = 100 * 1024 * 1024
+
+# fcntl command to disable caching on a descriptor (<sys/fcntl.h>, macOS only)
+F_NOCACHE = getattr(fcntl, 'F_NOCACHE', 48 if sys.platform == 'darwin' else None)
+
+# Threads used to scan directories when estimating the sparsebundle size
+SIZE_SCAN_WORKERS = 16
+
+# Hash log entries are flushed and synced to disk in batches of this size
+HASH_LOG_FLUSH_INTERVAL = 256
+
+# Sparsebundles larger than this (MB) use bigger bands to keep the band count down
+LARGE_BUNDLE_THRESHOLD_MB = 20480
+
+# Band size for large sparsebundles in 512-byte sectors (128 MiB; hdiutil default is 8 MiB)
+SPARSE_BAND_SIZE = 262144
+
+# APFS volume snapshotted in --apfs-snapshot mode (the Data volume on macOS 10.15+)
+SNAPSHOT_VOLUME = '/System/Volumes/Data' if os.path.isdir('/System/Volumes/Data') else '/'
+
+# Where the source snapshot is mounted in --apfs-snapshot mode
+SNAPSHOT_MOUNT_POINT = '/Volumes/ForensicSrc'
+
+# Cache of source hashes keyed by path and stat info, reused across runs
+HASH_CACHE_PATH = os.path.join(log_dir, "hash_cache.sqlite")
+
+# copyfile(3) flags: ACLs, POSIX stat info and extended attributes (incl. resource forks)
+COPYFILE_ACL = 1 << 0
+COPYFILE_STAT = 1 << 1
+COPYFILE_XATTR = 1 << 2
+COPYFILE_METADATA = COPYFILE_ACL | COPYFILE_STAT | COPYFILE_XATTR
+
+# setattrlist(2) selection for the creation time (<sys/attr.h>), which copyfile(3) does not copy
+ATTR_BIT_MAP_COUNT = 5
+ATTR_CMN_CRTIME = 0x00000200
+FSOPT_NOFOLLOW = 0x00000001
+
+class _AttrList(ctypes.Structure):
+    _fields_ = [('bitmapcount', ctypes.c_ushort), ('reserved', ctypes.c_uint16),
+                ('commonattr', ctypes.c_uint32), ('volattr', ctypes.c_uint32),
+                ('dirattr', ctypes.c_uint32), ('fileattr', ctypes.c_uint32),
+                ('forkattr', ctypes.c_uint32)]
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+# libc copyfile(3) and setattrlist(2), only present on macOS
+_libc = ctypes.CDLL(None, use_errno=True)
+_copyfile = getattr(_libc, 'copyfile', None)
+if _copyfile is not None:
+    _copyfile.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_void_p, ctypes.c_uint32]
+    _copyfile.restype = ctypes.c_int
+_setattrlist = getattr(_libc, 'setattrlist', None)
+if _setattrlist is not None:
+    _setattrlist.argtypes = [ctypes.c_char_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t,
+                             ctypes.c_uint32]
+    _setattrlist.restype = ctypes.c_int
+
+# Files at least this large are hashed one at a time outside the hashing process
+# pool, using HASH_WORKERS threads (BLAKE3, or calculate_hash_parallel for SHA-256)
+PARALLEL_HASH_THRESHOLD = 1024 * 1024 * 1024
+
+# Segment size for the tree hash used when BLAKE3 is not available
+TREE_HASH_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# System details used in logs and reports, gathered once without subprocesses
+_SYS_INFO = {
+    'user': pwd.getpwuid(os.geteuid()).pw_name,
+    'hostname': socket.gethostname(),
+    'macos_version': platform.mac_ver()[0],
+}
+
+def log_system_info():
+    """Log system information for forensic documentation."""
+    logger.info("=== System Information ===")
+    try:
+        logger.info(f"User: {_SYS_INFO['user']}")
+        logger.info(f"Hostname: {_SYS_INFO['hostname']}")
+        logger.info(f"macOS Version: {_SYS_INFO['macos_version']}")
+        logger.info(f"Build Version: {subprocess.check_output(['sw_vers', '-buildVersion'], text=True).strip()}")
+        logger.info(f"Architecture: {platform.machine()}")
+        logger.info(f"Kernel Version: {platform.release()}")
+        logger.info(f"Current Time: {datetime.datetime.now().isoformat()}")
+        logger.info(f"Tool Version: Forensic Sparsebundle Creator 1.0.0")
+    except subprocess.SubprocessError as e:
+        logger.error(f"Error getting system information: {e}")
+
+def bypass_page_cache(fd, file_size, nocache_threshold=NOCACHE_THRESHOLD):
+    """Set F_NOCACHE on fd if the file is at least nocache_threshold bytes.
+    
+    A nocache_threshold of None never bypasses the cache. Returns True if
+    caching was disabled.
+    """
+    if F_NOCACHE is None or nocache_threshold is None or file_size < nocache_threshold:
+        return False
+    fcntl.fcntl(fd, F_NOCACHE, 1)
+    return True
+
+def _update_from_file(hash_obj, f, chunk_size):
+    """Feed an open file into hash_obj through one reusable buffer.
+    
+    readinto() and memoryview slices avoid allocating a bytes object per
+    chunk, and the bound methods are looked up once outside the loop.
+    """
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    readinto = f.readinto
+    update = hash_obj.update
+    while True:
+        n = readinto(buf)
+        if not n:
+            break
+        update(view[:n])
+
+def _hash_stream(f, algorithm, max_threads=1):
+    """Hash an open file with read() calls and return the hash object."""
+    if algorithm == 'blake3':
+        hash_obj = blake3.blake3(max_threads=max_threads)
+        _update_from_file(hash_obj, f, COPY_CHUNK_SIZE)
+    elif hasattr(hashlib, 'file_digest'):
+        # Python 3.11+: read/update loop runs in C
+        hash_obj = hashlib.file_digest(f, algorithm)
+    else:
+        hash_obj = hashlib.new(algorithm)
+        _update_from_file(hash_obj, f, HASH_CHUNK_SIZE)
+    return hash_obj
+
+def calculate_hash(file_path, algorithm=DEFAULT_HASH_ALGORITHM, nocache_threshold=NOCACHE_THRESHOLD,
+                   use_mmap=True, max_threads=1):
+    """Calculate hash for a file using the specified algorithm.
+    
+    Pass use_mmap=False for files that may change while being hashed: a
+    memory-mapped file truncated underneath the reader raises SIGBUS.
+    max_threads only applies to BLAKE3.
+    """
+    try:
+        with open(file_path, 'rb', buffering=0) as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if not use_mmap or bypass_page_cache(f.fileno(), file_size, nocache_threshold):
+                # mmap always goes through the page cache, so read() instead
+                return _hash_stream(f, algorithm, max_threads).hexdigest()
+            
+            if algorithm == 'blake3':
+                hasher = blake3.blake3(max_threads=max_threads)
+                hasher.update_mmap(file_path)
+                return hasher.hexdigest()
+            
+            if file_size == 0:
+                # Empty files cannot be memory-mapped
+                return hashlib.new(algorithm).hexdigest()
+            
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return _hash_stream(f, algorithm).hexdigest()
+            
+            # Hash straight from the page cache without copying into bytes
+            with mm:
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                hash_obj = hashlib.new(algorithm, mm)
+        return hash_obj.hexdigest()
+    except Exception as e:
+        logger.error(f"Error calculating hash for {file_path}: {e}")
+        return None
+
+def _hash_segment(fd, offset, file_size, algorithm, dst_fd=None):
+    """Hash one tree hash segment with pread(), copying it to dst_fd if given."""
+    hash_obj = hashlib.new(algorithm)
+    end = min(offset + TREE_HASH_SEGMENT_SIZE, file_size)
+    while offset < end:
+        chunk = os.pread(fd, min(COPY_CHUNK_SIZE, end - offset), offset)
+        if not chunk:
+            break
+        hash_obj.update(chunk)
+        if dst_fd is not None:
+            written = 0
+            while written < len(chunk):
+                written += os.pwrite(dst_fd, chunk[written:], offset + written)
+        offset += len(chunk)
+    return hash_obj.digest()
+
+def tree_hash(fd, file_size, algorithm, executor, dst_fd=None):
+    """Return the tree hash of fd, hashing its segments on executor.
+    
+    With dst_fd, each segment is also written to the same offset of dst_fd,
+    so a file can be copied and tree-hashed in one parallel pass.
+    """
+    hash_segment = functools.partial(_hash_segment, fd, file_size=file_size,
+                                     algorithm=algorithm, dst_fd=dst_fd)
+    offsets = range(0, file_size, TREE_HASH_SEGMENT_SIZE)
+    digests = executor.map(hash_segment, offsets)
+    return hashlib.new(algorithm, b''.join(digests)).hexdigest()
+
+def calculate_hash_parallel(file_path, algorithm=DEFAULT_HASH_ALGORITHM, max_threads=HASH_WORKERS,
+                            nocache_threshold=NOCACHE_THRESHOLD):
+    """Calculate a tree hash for a large file using multiple threads.
+    
+    The file is split into TREE_HASH_SEGMENT_SIZE segments, each segment is
+    hashed, and the result is the hash of the concatenated segment digests.
+    Segments are read with pread() on one descriptor, which honours
+    nocache_threshold and is safe if the file changes while being read.
+    Not used for BLAKE3, which parallelizes internally (see calculate_hash).
+    """
+    try:
+        with open(file_path, 'rb', buffering=0) as f, \
+                ThreadPoolExecutor(max_workers=max_threads) as executor:
+            file_size = os.fstat(f.fileno()).st_size
+            bypass_page_cache(f.fileno(), file_size, nocache_threshold)
+            return tree_hash(f.fileno(), file_size, algorithm, executor)
+    except Exception as e:
+        logger.error(f"Error calculating parallel hash for {file_path}: {e}")
+        return None
+
+def get_hash_mode(file_size, algorithm=DEFAULT_HASH_ALGORITHM):
+    """Return the hash mode recorded in the report for a file of this size."""
+    if file_size >= PARALLEL_HASH_THRESHOLD and algorithm != 'blake3':
+        return f"tree-{TREE_HASH_SEGMENT_SIZE // (1024 * 1024)}MiB"
+    return 'standard'
+
+def hash_file(file_path, hash_mode, nocache_threshold=NOCACHE_THRESHOLD, use_mmap=True,
+              max_threads=1):
+    """Hash a file in the given hash mode (see get_hash_mode)."""
+    if hash_mode == 'standard':
+        return calculate_hash(file_path, nocache_threshold=nocache_threshold, use_mmap=use_mmap,
+                              max_threads=max_threads)
+    return calculate_hash_parallel(file_path, max_threads=max_threads,
+                                   nocache_threshold=nocache_threshold)
+
+def is_large_file(file_path):
+    """Return True if a file is big enough to be hashed outside the process pool."""
+    try:
+        return os.path.getsize(file_path) >= PARALLEL_HASH_THRESHOLD
+    except OSError:
+        return False
+
+# Per-process connection to the hash cache, opened on first use
+_hash_cache = None
+_hash_cache_pid = None
+_hash_cache_lock = threading.Lock()
+
+def _get_hash_cache():
+    """Return this process's connection to the hash cache database."""
+    global _hash_cache, _hash_cache_pid
+    if _hash_cache is None or _hash_cache_pid != os.getpid():
+        conn = sqlite3.connect(HASH_CACHE_PATH, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS hashes ('
+            'path TEXT, algo TEXT, size INTEGER, mtime_ns INTEGER, ctime_ns INTEGER, '
+            'inode INTEGER, hexdigest TEXT, PRIMARY KEY (path, algo))'
+        )
+        _hash_cache, _hash_cache_pid = conn, os.getpid()
+    return _hash_cache
+
+def get_cached_hash(file_path, cache_key, st):
+    """Return the cached digest for a file if its stat info is unchanged."""
+    try:
+        with _hash_cache_lock:
+            row = _get_hash_cache().execute(
+                'SELECT size, mtime_ns, ctime_ns, inode, hexdigest FROM hashes '
+                'WHERE path = ? AND algo = ?',
+                (file_path, cache_key)
+            ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"Hash cache lookup failed for {file_path}: {e}")
+        return None
+    
+    if row and row[:4] == (st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino):
+        return row[4]
+    return None
+
+def store_cached_hash(file_path, cache_key, st, hexdigest):
+    """Store a digest in the hash cache along with the stat info it belongs to."""
+    try:
+        with _hash_cache_lock:
+            conn = _get_hash_cache()
+            conn.execute(
+                'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (file_path, cache_key, st.st_size, st.st_mtime_ns, st.st_ctime_ns,
+                 st.st_ino, hexdigest)
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.warning(f"Hash cache update failed for {file_path}: {e}")
+
+def _init_hash_worker(log_queue):
+    """Send a hashing worker's log records to the parent process."""
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+
+@contextlib.contextmanager
+def worker_log_queue():
+    """Yield a queue whose log records are written to this process's log handlers."""
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_queue, *logging.getLogger().handlers)
+    listener.start()
+    try:
+        yield log_queue
+    finally:
+        listener.stop()
+
+def new_hash_pool(log_queue):
+    """Start a process pool for hashing whose workers log through log_queue."""
+    return ProcessPoolExecutor(max_workers=HASH_WORKERS, initializer=_init_hash_worker,
+                               initargs=(log_queue,))
+
+def _hash_source(pair, nocache_threshold=NOCACHE_THRESHOLD, use_hash_cache=False, max_threads=1):
+    """Hash the source of a (source, destination, source_hash, hash_mode) entry.
+    
+    Runs in a worker process, or on a thread for large files. With
+    use_hash_cache, a digest from an earlier run is reused when the file's
+    size, mtime, ctime and inode are unchanged. Returns a tuple of
+    (source_hash, hash_mode, cached).
+    """
+    source = pair[0]
+    try:
+        st = os.stat(source)
+    except OSError:
+        st = None
+    
+    hash_mode = get_hash_mode(st.st_size if st else 0)
+    cache_key = f"{DEFAULT_HASH_ALGORITHM}:{hash_mode}"
+    
+    if use_hash_cache and st is not None:
+        cached_hash = get_cached_hash(source, cache_key, st)
+        if cached_hash is not None:
+            return cached_hash, hash_mode, True
+    
+    # Sources are live files, so avoid mmap
+    source_hash = hash_file(source, hash_mode, nocache_threshold, use_mmap=False,
+                            max_threads=max_threads)
+    if use_hash_cache and st is not None and source_hash is not None:
+        store_cached_hash(source, cache_key, st, source_hash)
+    return source_hash, hash_mode, False
+
+def _hash_destination(hash_entry, nocache_threshold=NOCACHE_THRESHOLD, max_threads=1):
+    """Hash the destination of a hash log entry; runs in a worker process or thread."""
+    return hash_file(hash_entry['destination_path'], hash_entry['hash_mode'], nocache_threshold,
+                     max_threads=max_threads)
+
+def write_hash_entry(hash_log_file, hash_entry, entries_written):
+    """Append an entry to the NDJSON hash log, syncing it to disk in batches."""
+    hash_log_file.write(json.dumps(hash_entry) + '\n')
+    if (entries_written + 1) % HASH_LOG_FLUSH_INTERVAL == 0:
+        hash_log_file.flush()
+        os.fsync(hash_log_file.fileno())
+
+def record_hash_result(pair, source_hash, hash_mode, hash_log_file, entries_written,
+                       cached=False, source_path=None):
+    """Write the hash log entry for a copied file.
+    
+    source_path is the path the user selected when the file was read from
+    somewhere else (a source snapshot); the path read is then recorded as
+    snapshot_path. Returns True if the source hash could be calculated.
+    """
+    source, destination = pair[:2]
+    source_path = source_path or source
+    hash_entry = {
+        'source_path': source_path,
+        'destination_path': destination,
+        'hash_algorithm': DEFAULT_HASH_ALGORITHM,
+        'hash_mode': hash_mode,
+        'hash_source': source_hash,
+        'hash_cached': cached,
+        'timestamp': datetime.datetime.now().isoformat()
+    }
+    if source != source_path:
+        hash_entry['snapshot_path'] = source
+    write_hash_entry(hash_log_file, hash_entry, entries_written)
+    
+    if source_hash is None:
+        logger.error(f"No hash recorded for {source_path}")
+        return False
+    return True
+
+def verify_copied_files(hash_log_path, nocache_threshold=NOCACHE_THRESHOLD):
+    """Re-hash copied files in parallel and compare them with the hash log.
+    
+    Meant to run against the sparsebundle mounted read-only. Returns a tuple
+    of (all_match, results) where results holds each hash log entry, in log
+    order, with its hash_destination and whether it matched.
+    """
+    logger.info("Verifying copied files against the hash log")
+    
+    with open(hash_log_path) as f:
+        hash_log = [json.loads(line) for line in f]
+    
+    all_match = True
+    results = [None] * len(hash_log)
+    
+    def submit_hash(entry):
+        nonlocal executor
+        if is_large_file(entry['destination_path']):
+            # Hashed with HASH_WORKERS threads, so keep it out of the process pool
+            return large_file_pool.submit(_hash_destination, entry, nocache_threshold,
+                                          HASH_WORKERS)
+        try:
+            return executor.submit(_hash_destination, entry, nocache_threshold)
+        except BrokenProcessPool:
+            logger.warning("Hash worker pool is broken, starting a new one")
+            executor.shutdown(wait=False)
+            executor = new_hash_pool(log_queue)
+            return executor.submit(_hash_destination, entry, nocache_threshold)
+    
+    with worker_log_queue() as log_queue, ThreadPoolExecutor(max_workers=1) as large_file_pool:
+        executor = new_hash_pool(log_queue)
+        try:
+            futures = {submit_hash(entry): i for i, entry in enumerate(hash_log)}
+            for future in as_completed(futures):
+                entry = hash_log[futures[future]]
+                try:
+                    dest_hash = future.result()
+                except Exception as e:
+                    logger.error(f"Hash worker failed for {entry['destination_path']}: {e!r}")
+                    dest_hash = None
+                
+                match = dest_hash is not None and dest_hash == entry['hash_source']
+                if not match:
+                    logger.error(f"Hash mismatch for {entry['source_path']}!")
+                    logger.error(f"Source: {entry['hash_source']}")
+                    logger.error(f"Destination: {dest_hash}")
+                    all_match = False
+                results[futures[future]] = dict(entry, hash_destination=dest_hash, match=match)
+        finally:
+            executor.shutdown()
+    
+    if all_match:
+        logger.info(f"Verified {len(hash_log)} files: all hashes match")
+    else:
+        logger.error(f"Verified {len(hash_log)} files: hash mismatches found")
+    return all_match, results
+
+def create_audit_report(results, sparsebundle_path):
+    """Write the --verify results next to the host log file.
+    
+    The sparsebundle is mounted read-only during verification, so the audit
+    goes to <log file>_verification_audit.plist and .txt instead of into it.
+    """
+    audit_base = f"{os.path.splitext(log_file)[0]}_verification_audit"
+    matched = sum(1 for r in results if r['match'])
+    audit_data = {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'sparsebundle_path': sparsebundle_path,
+        'tool_version': "Forensic Sparsebundle Creator 1.0.0",
+        'files_verified': len(results),
+        'files_matched': matched,
+        # plistlib cannot store None, so hashes that could not be computed are left out
+        'file_hashes': [{k: v for k, v in r.items() if v is not None} for r in results]
+    }
+    
+    try:
+        with open(f"{audit_base}.txt", 'w') as f:
+            f.write(f"FORENSIC SPARSEBUNDLE VERIFICATION AUDIT\n")
+            f.write(f"=====================================\n\n")
+            f.write(f"Created: {audit_data['timestamp']}\n")
+            f.write(f"Sparsebundle: {sparsebundle_path}\n")
+            f.write(f"Tool Version: {audit_data['tool_version']}\n")
+            f.write(f"Files Matched: {matched} of {len(results)}\n\n")
+            
+            f.write(f"FILE HASHES\n")
+            f.write(f"-----------\n")
+            for r in results:
+                algorithm = r['hash_algorithm'].upper()
+                f.write(f"Source: {r['source_path']}\n")
+                f.write(f"Destination: {r['destination_path']}\n")
+                f.write(f"Hash Mode: {r['hash_mode']}\n")
+                f.write(f"Source {algorithm}: {r['hash_source']}\n")
+                f.write(f"Destination {algorithm}: {r['hash_destination']}\n")
+                f.write(f"Match: {r['match']}\n\n")
+        
+        with open(f"{audit_base}.plist", 'wb') as f:
+            plistlib.dump(audit_data, f)
+        
+        logger.info(f"Verification audit written to: {audit_base}.plist and .txt")
+        return True
+    except Exception as e:
+        logger.error(f"Error creating verification audit: {e}")
+        return False
+
+def execute_command(cmd, description):
+    """Execute a shell command and log the output."""
+    logger.info(f"Executing: {description}")
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug(f"Command: {' '.join(cmd)}")
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+        
+        if result.returncode != 0:
+            logger.error(f"{description} failed with code {result.returncode}")
+            logger.error(f"Error output: {result.stderr.strip()}")
+            return False, result.stderr
+        
+        if debug:
+            logger.debug(f"Output: {result.stdout.strip()}")
+        return True, result.stdout
+    except Exception as e:
+        logger.error(f"Exception while {description}: {e}")
+        return False, str(e)
+
+def create_sparsebundle(destination_path, name, size_mb=10240):
+    """Create a sparsebundle with the given name and size."""
+    logger.info(f"Creating sparsebundle: {name} with size: {size_mb}MB")
+    
+    sparsebundle_path = os.path.join(destination_path, f"{name}.sparsebundle")
+    
+    if os.path.exists(sparsebundle_path):
+        logger.warning(f"Sparsebundle already exists at {sparsebundle_path}")
+        return False, sparsebundle_path
+    
+    cmd = [
+        'hdiutil', 'create',
+        '-size', f'{size_mb}m',
+        '-fs', 'APFS',
+        '-volname', name,
+        '-type', 'SPARSEBUNDLE',
+        '-encryption', 'AES-256',
+    ]
+    if size_mb > LARGE_BUNDLE_THRESHOLD_MB:
+        cmd += ['-imagekey', f'sparse-band-size={SPARSE_BAND_SIZE}']
+    cmd.append(sparsebundle_path)
+    
+    success, output = execute_command(cmd, "Creating sparsebundle")
+    return success, sparsebundle_path
+
+def mount_sparsebundle(sparsebundle_path, readonly=False):
+    """Mount the sparsebundle and return the mount point."""
+    logger.info(f"Mounting sparsebundle: {sparsebundle_path}")
+    
+    cmd = ['hdiutil', 'attach', sparsebundle_path, '-mountpoint', '/Volumes/ForensicData']
+    if readonly:
+        cmd.append('-readonly')
+    success, output = execute_command(cmd, "Mounting sparsebundle")
+    
+    if success:
+        # Find the mount point from output
+        mount_point = '/Volumes/ForensicData'
+        logger.info(f"Sparsebundle mounted at: {mount_point}")
+        return True, mount_point
+    else:
+        return False, None
+
+def unmount_sparsebundle(mount_point):
+    """Unmount the sparsebundle."""
+    logger.info(f"Unmounting sparsebundle from: {mount_point}")
+    
+    cmd = ['hdiutil', 'detach', mount_point, '-force']
+    success, output = execute_command(cmd, "Unmounting sparsebundle")
+    return success
+
+def create_source_snapshot():
+    """Create an APFS local snapshot of SNAPSHOT_VOLUME and mount it.
+    
+    Snapshot mounts are always read-only, so the sources cannot change while
+    they are copied and hashed. Returns a tuple of (success, snapshot_info)
+    where snapshot_info holds the snapshot date, name, volume and mount point.
+    """
+    logger.info(f"Creating APFS snapshot of {SNAPSHOT_VOLUME}")
+    
+    success, output = execute_command(['tmutil', 'localsnapshot'], "Creating local snapshot")
+    match = re.search(r'(\d{4}-\d{2}-\d{2}-\d{6})', output) if success else None
+    if not match:
+        logger.error(f"Could not determine snapshot date from: {output.strip()}")
+        return False, None
+    
+    snapshot_info = {
+        'date': match.group(1),
+        'name': f"com.apple.TimeMachine.{match.group(1)}.local",
+        'volume': SNAPSHOT_VOLUME,
+        'mount_point': SNAPSHOT_MOUNT_POINT,
+    }
+    
+    os.makedirs(SNAPSHOT_MOUNT_POINT, exist_ok=True)
+    cmd = ['mount_apfs', '-o', 'nobrowse', '-s', snapshot_info['name'],
+           SNAPSHOT_VOLUME, SNAPSHOT_MOUNT_POINT]
+    success, output = execute_command(cmd, "Mounting source snapshot")
+    if not success:
+        execute_command(['tmutil', 'deletelocalsnapshots', snapshot_info['date']],
+                        "Deleting local snapshot")
+        return False, None
+    
+    logger.info(f"Snapshot {snapshot_info['name']} mounted at: {SNAPSHOT_MOUNT_POINT}")
+    return True, snapshot_info
+
+def map_to_snapshot(path, snapshot_info):
+    """Return the path of a selected item inside the mounted snapshot.
+    
+    Items on other volumes are not part of the snapshot and are returned
+    unchanged.
+    """
+    real_path = os.path.realpath(path)
+    volume = snapshot_info['volume']
+    try:
+        if os.stat(real_path).st_dev != os.stat(volume).st_dev:
+            logger.warning(f"{path} is not on {volume}; copying it from the live file system")
+            return path
+    except OSError:
+        return path
+    
+    # Firmlinked paths such as /Users live at the root of the Data volume
+    if volume != '/' and (real_path == volume or real_path.startswith(volume + os.sep)):
+        rel_path = os.path.relpath(real_path, volume)
+    else:
+        rel_path = os.path.relpath(real_path, '/')
+    return os.path.normpath(os.path.join(snapshot_info['mount_point'], rel_path))
+
+def remove_source_snapshot(snapshot_info):
+    """Unmount and delete the source snapshot."""
+    logger.info(f"Removing snapshot {snapshot_info['name']}")
+    
+    success, output = execute_command(['umount', snapshot_info['mount_point']],
+                                      "Unmounting source snapshot")
+    if success:
+        try:
+            os.rmdir(snapshot_info['mount_point'])
+        except OSError as e:
+            logger.warning(f"Could not remove {snapshot_info['mount_point']}: {e}")
+        success, output = execute_command(
+            ['tmutil', 'deletelocalsnapshots', snapshot_info['date']],
+            "Deleting local snapshot"
+        )
+    return success
+
+def set_creation_time(path, st):
+    """Give path the creation (birth) time from the stat result st."""
+    if _setattrlist is None or not hasattr(st, 'st_birthtime'):
+        return
+    
+    birthtime_ns = getattr(st, 'st_birthtime_ns', None)
+    if birthtime_ns is None:
+        birthtime_ns = int(st.st_birthtime * 1_000_000_000)
+    crtime = _Timespec(*divmod(birthtime_ns, 1_000_000_000))
+    attrs = _AttrList(bitmapcount=ATTR_BIT_MAP_COUNT, commonattr=ATTR_CMN_CRTIME)
+    if _setattrlist(os.fsencode(path), ctypes.byref(attrs), ctypes.byref(crtime),
+                    ctypes.sizeof(crtime), FSOPT_NOFOLLOW) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+
+def copy_metadata(source, destination):
+    """Copy ACLs, extended attributes, ownership, permissions, timestamps and flags."""
+    st = os.stat(source)
+    if _copyfile is None:
+        shutil.copystat(source, destination)
+        return
+    
+    if _copyfile(os.fsencode(source), os.fsencode(destination), None, COPYFILE_METADATA) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), source)
+    
+    # COPYFILE_STAT also copies the BSD flags; clear them until the times are
+    # set, since a locked (uchg) file's times cannot be changed
+    flags = getattr(st, 'st_flags', 0)
+    if flags:
+        os.chflags(destination, 0)
+    
+    # Set timestamps explicitly so nothing above modifies them. The creation
+    # time goes after utime(), which pulls it back to an earlier mtime
+    os.utime(destination, ns=(st.st_atime_ns, st.st_mtime_ns))
+    set_creation_time(destination, st)
+    
+    if flags:
+        os.chflags(destination, flags)
+
+def copy_and_hash(source, destination, algorithm=DEFAULT_HASH_ALGORITHM,
+                  nocache_threshold=NOCACHE_THRESHOLD, segment_pool=None):
+    """Copy a file while hashing it, reading the source only once.
+    
+    Files of PARALLEL_HASH_THRESHOLD bytes or more are hashed on several
+    threads, in the same hash mode as the parallel hash pass: SHA-256 tree
+    hash segments are copied and hashed on segment_pool, and BLAKE3 uses
+    HASH_WORKERS threads. Returns a tuple of (hexdigest, hash_mode).
+    """
+    with open(source, 'rb', buffering=0) as src, open(destination, 'wb') as dst:
+        file_size = os.fstat(src.fileno()).st_size
+        if bypass_page_cache(src.fileno(), file_size, nocache_threshold):
+            bypass_page_cache(dst.fileno(), file_size, nocache_threshold)
+        
+        hash_mode = get_hash_mode(file_size, algorithm)
+        if hash_mode != 'standard':
+            if segment_pool is None:
+                with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+                    hexdigest = tree_hash(src.fileno(), file_size, algorithm, executor,
+                                          dst.fileno())
+            else:
+                hexdigest = tree_hash(src.fileno(), file_size, algorithm, segment_pool,
+                                      dst.fileno())
+        else:
+            if algorithm == 'blake3':
+                max_threads = HASH_WORKERS if file_size >= PARALLEL_HASH_THRESHOLD else 1
+                hash_obj = blake3.blake3(max_threads=max_threads)
+            else:
+                hash_obj = hashlib.new(algorithm)
+            
+            buf = bytearray(COPY_CHUNK_SIZE)
+            view = memoryview(buf)
+            readinto = src.readinto
+            update = hash_obj.update
+            write = dst.write
+            while True:
+                n = readinto(buf)
+                if not n:
+                    break
+                chunk = view[:n]
+                update(chunk)
+                write(chunk)
+            hexdigest = hash_obj.hexdigest()
+    
+    copy_metadata(source, destination)
+    return hexdigest, hash_mode
+
+def copy_with_metadata(source, destination, hash_pairs, nocache_threshold=NOCACHE_THRESHOLD,
+                       segment_pool=None):
+    """Copy files/folders preserving metadata.
+    
+    Copied files are appended to hash_pairs as (source, destination,
+    source_hash, hash_mode) so unhashed sources can be hashed in a parallel
+    pass. source_hash and hash_mode are None when the file was not hashed
+    during the copy.
+    """
+    logger.info(f"Copying: {source} -> {destination}")
+    
+    try:
+        if os.path.isfile(source):
+            dest_file = (os.path.join(destination, os.path.basename(source))
+                         if os.path.isdir(destination) else destination)
+            
+            try:
+                # Single pass: hash the source while writing the copy
+                source_hash, hash_mode = copy_and_hash(source, dest_file,
+                                                       nocache_threshold=nocache_threshold,
+                                                       segment_pool=segment_pool)
+            except OSError as e:
+                # Leave edge cases copyfile(3) rejects (e.g. AppleDouble) to ditto
+                logger.warning(f"In-process copy of {source} failed ({e}), retrying with ditto")
+                cmd = ['ditto', '-v', source, dest_file]
+                success, output = execute_command(cmd, f"Copying file {source}")
+                if not success:
+                    return False
+                source_hash = hash_mode = None
+            
+            hash_pairs.append((source, dest_file, source_hash, hash_mode))
+        else:
+            # e.g. a selected item missing from the source snapshot
+            logger.error(f"Cannot copy {source}: not a file or folder")
+            return False
+        
+        return True
+    except Exception as e:
+        logger.error(f"Error copying {source}: {e}")
+        return False
+
+def copy_directory(source, dest_root, hash_pairs):
+    """Copy a directory to dest_root preserving metadata with ditto.
+    
+    Every regular file in the copied tree is appended to hash_pairs as
+    (source, destination, None, None) for the parallel hash pass.
+    """
+    logger.info(f"Copying: {source} -> {dest_root}")
+    
+    try:
+        os.makedirs(dest_root, exist_ok=True)
+    except OSError as e:
+        logger.error(f"Error creating {dest_root}: {e}")
+        return False
+    
+    # Without -c, ditto copies the contents of source into dest_root
+    cmd = ['ditto', '-v', source, dest_root]
+    success, output = execute_command(cmd, f"Copying directory {source}")
+    if not success:
+        return False
+    
+    if not os.path.isdir(dest_root):
+        logger.error(f"Copied directory {dest_root} not found")
+        return False
+    
+    try:
+        for dirpath, dirnames, filenames in os.walk(dest_root):
+            rel_dir = os.path.relpath(dirpath, dest_root)
+            for f in filenames:
+                dest_file = os.path.join(dirpath, f)
+                if os.path.islink(dest_file) or not os.path.isfile(dest_file):
+                    continue
+                source_file = os.path.normpath(os.path.join(source, rel_dir, f))
+                hash_pairs.append((source_file, dest_file, None, None))
+        return True
+    except Exception as e:
+        logger.error(f"Error enumerating copied directory {dest_root}: {e}")
+        return False
+
+def destination_names(selected_paths):
+    """Map each selected path to a unique name in the destination folder.
+    
+    Items sharing a basename (compared case-insensitively, like the
+    destination volume) would overwrite each other, so later ones get a
+    numeric suffix, e.g. report_2.pdf.
+    """
+    names = {}
+    taken = set()
+    for path in selected_paths:
+        name = os.path.basename(os.path.normpath(path))
+        stem, ext = os.path.splitext(name) if not os.path.isdir(path) else (name, '')
+        n = 1
+        while name.casefold() in taken:
+            n += 1
+            name = f"{stem}_{n}{ext}"
+        if n > 1:
+            logger.warning(f"Destination name of {path} is already taken, copying it as {name}")
+        taken.add(name.casefold())
+        names[path] = name
+    return names
+
+def copy_and_hash_paths(selected_paths, destination, hash_log_file,
+                        nocache_threshold=NOCACHE_THRESHOLD, use_hash_cache=False,
+                        snapshot_info=None):
+    """Copy the selected items and hash the sources, overlapping both stages.
+    
+    Copies run on a thread pool. Selected files are hashed during the copy
+    (large ones on several threads) and logged directly; files from selected
+    folders are handed to a process pool for hashing as soon as their copy
+    finishes, with at most HASH_QUEUE_DEPTH files queued at once; files of
+    PARALLEL_HASH_THRESHOLD bytes or more are hashed one at a time on a
+    separate thread instead. Either way a file's hash mode depends only on
+    its size. Files of at least
+    nocache_threshold bytes are read without the page cache, and
+    use_hash_cache allows source digests from earlier runs to be reused.
+    With snapshot_info, items are read from the mounted source snapshot but
+    logged under their selected paths. Returns True if every copy succeeded
+    and every source was hashed.
+    """
+    selected_paths = list(dict.fromkeys(selected_paths))
+    selected_dirs = {p for p in selected_paths if os.path.isdir(p)}
+    # Unique names up front, so no two copy threads write the same destination
+    names = destination_names(selected_paths)
+    
+    success = True
+    entries_written = 0
+    hash_futures = {}
+    hash_source = functools.partial(_hash_source, nocache_threshold=nocache_threshold,
+                                    use_hash_cache=use_hash_cache)
+    
+    def record(pair, source_path, source_hash, hash_mode, cached=False):
+        nonlocal success, entries_written
+        if not record_hash_result(pair, source_hash, hash_mode, hash_log_file,
+                                  entries_written, cached, source_path):
+            success = False
+        entries_written += 1
+    
+    def record_done(return_when):
+        done, _ = wait(hash_futures, return_when=return_when)
+        for future in done:
+            pair, source_path = hash_futures.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                # A dead worker must not abort the acquisition; log the file as unhashed
+                logger.error(f"Hash worker failed for {source_path}: {e!r}")
+                result = (None, 'standard')
+            record(pair, source_path, *result)
+    
+    def submit_hash(pair):
+        nonlocal cpu_pool
+        if is_large_file(pair[0]):
+            # Hashed with HASH_WORKERS threads, so keep it out of the process pool
+            return large_file_pool.submit(hash_source, pair, max_threads=HASH_WORKERS)
+        try:
+            return cpu_pool.submit(hash_source, pair)
+        except BrokenProcessPool:
+            logger.warning("Hash worker pool is broken, starting a new one")
+            cpu_pool.shutdown(wait=False)
+            cpu_pool = new_hash_pool(log_queue)
+            return cpu_pool.submit(hash_source, pair)
+    
+    with worker_log_queue() as log_queue, ThreadPoolExecutor(max_workers=1) as large_file_pool, \
+            ThreadPoolExecutor(max_workers=HASH_WORKERS) as segment_pool:
+        cpu_pool = new_hash_pool(log_queue)
+        try:
+            with ThreadPoolExecutor(max_workers=COPY_WORKERS) as io_pool:
+                copy_futures = {}
+                for path in selected_paths:
+                    read_path = map_to_snapshot(path, snapshot_info) if snapshot_info else path
+                    pairs = []
+                    if path in selected_dirs:
+                        future = io_pool.submit(copy_directory, read_path,
+                                                os.path.join(destination, names[path]), pairs)
+                    else:
+                        future = io_pool.submit(copy_with_metadata, read_path,
+                                                os.path.join(destination, names[path]), pairs,
+                                                nocache_threshold, segment_pool)
+                    copy_futures[future] = (path, read_path, pairs)
+                
+                for future in as_completed(copy_futures):
+                    path, read_path, pairs = copy_futures[future]
+                    if not future.result():
+                        logger.error(f"Failed to copy {path}")
+                        success = False
+                    
+                    for pair in pairs:
+                        # Log files under the selected path, not the snapshot path read
+                        source_path = (path if pair[0] == read_path else
+                                       os.path.join(path, os.path.relpath(pair[0], read_path)))
+                        if pair[2] is not None:
+                            # Hashed while copying
+                            record(pair, source_path, pair[2], pair[3])
+                            continue
+                        if len(hash_futures) >= HASH_QUEUE_DEPTH:
+                            record_done(FIRST_COMPLETED)
+                        hash_futures[submit_hash(pair)] = (pair, source_path)
+                
+                while hash_futures:
+                    record_done(FIRST_COMPLETED)
+        finally:
+            cpu_pool.shutdown()
+    
+    logger.info(f"Recorded hashes for {entries_written} copied files")
+    return success
+
+def select_files_and_folders():
+    """Open a file dialog for selecting multiple files and folders."""
+    logger.info("Prompting user to select files and folders")
+    
+    root = tk.Tk()
+    root.withdraw()  # Hide the main window
+    
+    # Inform the user about the selection process
+    logger.info("Please select files and folders to include in the sparsebundle")
+    
+    # First, select files (can select multiple at once)
+    files = list(filedialog.askopenfilenames(
+        title="Select files to include in sparsebundle (or cancel if selecting folders only)",
+        multiple=True
+    ))
+    
+    # Then ask if user wants to select folders
+    folders = []
+    select_folders = tk.messagebox.askyesno(
+        "Select Folders",
+        "Would you like to select folders as well?"
+    )
+    
+    # If yes, allow folder selection
+    if select_folders:
+        # Create a custom dialog for folder selection with a "Done" button
+        folder_select_window = tk.Toplevel(root)
+        folder_select_window.title("Select Folders")
+        folder_select_window.geometry("500x300")
+        
+        tk.Label(folder_select_window, 
+                text="Click 'Select Folder' to add folders to the selection.\nClick 'Done' when finished.",
+                pady=10).pack()
+        
+        selected_folders_listbox = tk.Listbox(folder_select_window, width=60, height=10)
+        selected_folders_listbox.pack(pady=10, padx=10, fill=tk.BOTH, expand=True)
+        
+        buttons_frame = tk.Frame(folder_select_window)
+        buttons_frame.pack(pady=10)
+        
+        def add_folder():
+            folder_path = filedialog.askdirectory(
+                title="Select a folder to include",
+                parent=folder_select_window
+            )
+            if folder_path:
+                folders.append(folder_path)
+                selected_folders_listbox.insert(tk.END, folder_path)
+        
+        def finish_selection():
+            folder_select_window.destroy()
+        
+        tk.Button(buttons_frame, text="Select Folder", command=add_folder).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons_frame, text="Done", command=finish_selection).pack(side=tk.LEFT, padx=5)
+        
+        # Wait for this window to be closed before continuing
+        root.wait_window(folder_select_window)
+    
+    root.destroy()
+    
+    all_paths = files + folders
+    if not all_paths:
+        logger.warning("No files or folders were selected")
+    else:
+        logger.info(f"Selected {len(files)} files and {len(folders)} folders")
+        for path in all_paths:
+            logger.info(f"Selected: {path}")
+    
+    return all_paths
+
+def _entry_size(st):
+    """Return the space a file is expected to take up once copied.
+    
+    Small files occupy whole blocks, while sparse files are written out in
+    full by the copy, so use whichever of the two sizes is larger.
+    """
+    return max(st.st_size, getattr(st, 'st_blocks', 0) * 512)
+
+def _scan_dir(path):
+    """Scan one directory level with one stat per entry.
+    
+    Returns a tuple of (total_file_size, subdirectories).
+    """
+    total = 0
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                # Symlinks are not followed to avoid double counting
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total += _entry_size(entry.stat(follow_symlinks=False))
+    except OSError as e:
+        logger.warning(f"Could not scan {path}: {e}")
+    return total, subdirs
+
+def _tree_size(path):
+    """Sum file sizes below a directory, scanning subdirectories in parallel."""
+    total = 0
+    with ThreadPoolExecutor(max_workers=SIZE_SCAN_WORKERS) as executor:
+        pending = {executor.submit(_scan_dir, path)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                size, subdirs = future.result()
+                total += size
+                pending.update(executor.submit(_scan_dir, d) for d in subdirs)
+    return total
+
+def estimate_size_needed(paths):
+    """Estimate the size needed for the sparsebundle."""
+    logger.info("Estimating size needed for selected files and folders")
+    
+    total_size = 0
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                total_size += _tree_size(path)
+            elif os.path.isfile(path):
+                total_size += _entry_size(os.stat(path))
+        except Exception as e:
+            logger.error(f"Error calculating size for {path}: {e}")
+    
+    # Convert to MB and add 10% buffer
+    size_mb = int((total_size / (1024 * 1024)) * 1.1)
+    
+    # Ensure minimum size of 100MB
+    size_mb = max(size_mb, 100)
+    
+    logger.info(f"Estimated size needed: {size_mb}MB")
+    return size_mb
+
+def create_verification_report(hash_log_path, output_path, sparsebundle_path,
+                               snapshot_info=None):
+    """Create a verification report with all file hashes and operations.
+    
+    The NDJSON hash log is read once; the text report is written while
+    reading and the plist is written at the end.
+    """
+    logger.info("Creating verification report")
+    
+    report_path = os.path.join(output_path, "verification_report.plist")
+    
+    report_data = {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'sparsebundle_path': sparsebundle_path,
+        'tool_version': "Forensic Sparsebundle Creator 1.0.0",
+        'system_info': dict(_SYS_INFO),
+        'file_hashes': []
+    }
+    if snapshot_info:
+        report_data['source_snapshot'] = dict(snapshot_info)
+    
+    try:
+        txt_report_path = os.path.join(output_path, "verification_report.txt")
+        with open(hash_log_path) as hash_log, open(txt_report_path, 'w') as f:
+            f.write(f"FORENSIC SPARSEBUNDLE VERIFICATION REPORT\n")
+            f.write(f"=====================================\n\n")
+            f.write(f"Created: {report_data['timestamp']}\n")
+            f.write(f"Sparsebundle: {report_data['sparsebundle_path']}\n")
+            f.write(f"Tool Version: {report_data['tool_version']}\n\n")
+            
+            f.write(f"SYSTEM INFORMATION\n")
+            f.write(f"-----------------\n")
+            for k, v in report_data['system_info'].items():
+                f.write(f"{k}: {v}\n")
+            
+            if snapshot_info:
+                f.write(f"\nSOURCE SNAPSHOT\n")
+                f.write(f"---------------\n")
+                for k, v in snapshot_info.items():
+                    f.write(f"{k}: {v}\n")
+            
+            f.write(f"\nFILE HASHES\n")
+            f.write(f"-----------\n")
+            for line in hash_log:
+                entry = json.loads(line)
+                report_data['file_hashes'].append(entry)
+                f.write(f"Source: {entry['source_path']}\n")
+                if 'snapshot_path' in entry:
+                    f.write(f"Snapshot Path: {entry['snapshot_path']}\n")
+                f.write(f"Destination: {entry['destination_path']}\n")
+                algorithm = entry['hash_algorithm'].upper()
+                f.write(f"Hash Mode: {entry['hash_mode']}\n")
+                if entry.get('hash_cached'):
+                    f.write(f"Hash Cached: True\n")
+                f.write(f"Source {algorithm}: {entry['hash_source']}\n")
+                f.write(f"Timestamp: {entry['timestamp']}\n\n")
+        
+        logger.info(f"Text verification report created at: {txt_report_path}")
+        
+        with open(report_path, 'wb') as f:
+            plistlib.dump(report_data, f)
+        
+        logger.info(f"Verification report created at: {report_path}")
+        
+    except Exception as e:
+        logger.error(f"Error creating verification report: {e}")
+
+def parse_arguments(argv=None):
+    """Parse command line options."""
+    parser = argparse.ArgumentParser(description="Forensic Sparsebundle Creator")
+    parser.add_argument(
+        '--no-cache',
+        choices=['auto', 'always', 'never'],
+        default='auto',
+        help="Bypass the page cache (F_NOCACHE) when reading files: 'auto' for files "
+             f"of {NOCACHE_THRESHOLD // (1024 * 1024)} MiB or more, 'always' or 'never'"
+    )
+    parser.add_argument(
+        '--hash-cache',
+        action='store_true',
+        help="Reuse source digests cached by earlier runs for unchanged files instead "
+             "of re-reading them; cached files are not read this run, so combine "
+             "with --verify to tie their digests to the copies"
+    )
+    parser.add_argument(
+        '--apfs-snapshot',
+        action='store_true',
+        help="Take an APFS snapshot of the Data volume and copy and hash the "
+             "selected items from the read-only snapshot (requires root)"
+    )
+    parser.add_argument(
+        '--verify',
+        action='store_true',
+        help="After unmounting, remount the sparsebundle read-only and re-hash "
+             "every copied file against the recorded source hashes"
+    )
+    return parser.parse_args(argv)
+
+def main():
+    """Main function for the forensic sparsebundle creator."""
+    args = parse_arguments()
+    nocache_threshold = {
+        'auto': NOCACHE_THRESHOLD,
+        'always': 0,
+        'never': None,
+    }[args.no_cache]
+    
+    try:
+        logger.info("=== Forensic Sparsebundle Creator Started ===")
+        log_system_info()
+        
+        # Check if running on macOS
+        if sys.platform != 'darwin':
+            logger.error("This script is designed to run only on macOS")
+            return 1
+        
+        # Select files and folders
+        selected_paths = select_files_and_folders()
+        if not selected_paths:
+            logger.error("No files or folders were selected. Exiting.")
+            return 1
+        
+        # Get size estimate
+        size_needed = estimate_size_needed(selected_paths)
+        
+        # Get destination for sparsebundle
+        root = tk.Tk()
+        root.withdraw()
+        destination_path = filedialog.askdirectory(
+            title="Select where to save the sparsebundle"
+        )
+        root.destroy()
+        
+        if not destination_path:
+            logger.error("No destination selected. Exiting.")
+            return 1
+        
+        # Generate a unique name for the sparsebundle
+        sparsebundle_name = f"ForensicData_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        
+        # Create sparsebundle
+        success, sparsebundle_path = create_sparsebundle(destination_path, sparsebundle_name, size_needed)
+        if not success:
+            logger.error("Failed to create sparsebundle. Exiting.")
+            return 1
+        
+        # Mount sparsebundle
+        success, mount_point = mount_sparsebundle(sparsebundle_path)
+        if not success:
+            logger.error("Failed to mount sparsebundle. Exiting.")
+            return 1
+        
+        # Create a log directory inside the sparsebundle
+        log_dir_in_sparsebundle = os.path.join(mount_point, "forensic_logs")
+        os.makedirs(log_dir_in_sparsebundle, exist_ok=True)
+        
+        # Copy log file to the sparsebundle
+        shutil.copy2(log_file, log_dir_in_sparsebundle)
+        
+        # Create a directory for copied files
+        files_dir = os.path.join(mount_point, "copied_files")
+        os.makedirs(files_dir, exist_ok=True)
+        
+        # Copy files and folders while preserving metadata, hashing copies as
+        # they finish and streaming entries to the NDJSON hash log
+        hash_log_path = os.path.join(log_dir_in_sparsebundle, "verification_report.ndjson")
+        snapshot_info = None
+        if args.apfs_snapshot:
+            # Freeze the sources first, then read everything from the snapshot
+            snapshotted, snapshot_info = create_source_snapshot()
+            if not snapshotted:
+                logger.error("Failed to create APFS snapshot. Exiting.")
+                unmount_sparsebundle(mount_point)
+                return 1
+        
+        try:
+            with open(hash_log_path, 'w') as hash_log_file:
+                success = copy_and_hash_paths(selected_paths, files_dir, hash_log_file,
+                                              nocache_threshold, args.hash_cache,
+                                              snapshot_info)
+        finally:
+            if snapshot_info and not remove_source_snapshot(snapshot_info):
+                logger.error(f"Failed to remove snapshot {snapshot_info['name']}")
+        
+        # Create verification report
+        create_verification_report(hash_log_path, log_dir_in_sparsebundle, sparsebundle_path,
+                                   snapshot_info)
+        
+        # Unmount sparsebundle
+        if not unmount_sparsebundle(mount_point):
+            logger.error("Failed to unmount sparsebundle properly")
+            return 1
+        
+        # Optional audit pass against the read-only sparsebundle
+        if args.verify:
+            mounted, mount_point = mount_sparsebundle(sparsebundle_path, readonly=True)
+            if not mounted:
+                logger.error("Failed to remount sparsebundle for verification")
+                success = False
+            else:
+                verified, audit_results = verify_copied_files(hash_log_path, nocache_threshold)
+                if not create_audit_report(audit_results, sparsebundle_path):
+                    success = False
+                if not verified:
+                    success = False
+                if not unmount_sparsebundle(mount_point):
+                    logger.error("Failed to unmount sparsebundle after verification")
+                    return 1
+        
+        if success:
+            logger.info("=== Forensic Sparsebundle Creator Completed Successfully ===")
+            logger.info(f"Sparsebundle created at: {sparsebundle_path}")
+            logger.info(f"Log file: {log_file}")
+            return 0
+        else:
+            logger.error("=== Forensic Sparsebundle Creator Completed with Errors ===")
+            return 1
+            
+    except Exception as e:
+        logger.critical(f"Unhandled exception: {e}", exc_info=True)
+        return 1
+
+if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,213 @@
+"""Tests for the platform-independent helpers in MacOS_Collector.py."""
+
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import MacOS_Collector as collector
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+class DestinationNamesTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+
+    def path(self, *parts, data=b'x'):
+        return write_file(os.path.join(self.root, *parts), data)
+
+    def test_unique_names_are_kept(self):
+        a = self.path('a', 'report.pdf')
+        b = self.path('b', 'notes.txt')
+        self.assertEqual(collector.destination_names([a, b]),
+                         {a: 'report.pdf', b: 'notes.txt'})
+
+    def test_duplicate_files_get_numbered_suffixes(self):
+        paths = [self.path(d, 'report.pdf') for d in ('a', 'b', 'c')]
+        names = collector.destination_names(paths)
+        self.assertEqual([names[p] for p in paths],
+                         ['report.pdf', 'report_2.pdf', 'report_3.pdf'])
+
+    def test_names_are_compared_case_insensitively(self):
+        a = self.path('a', 'Report.pdf')
+        b = self.path('b', 'report.PDF')
+        names = collector.destination_names([a, b])
+        self.assertEqual(names[b], 'report_2.PDF')
+
+    def test_directory_and_file_with_same_name(self):
+        folder = os.path.join(self.root, 'a', 'evidence.v1')
+        self.path('a', 'evidence.v1', 'inner')
+        f = self.path('b', 'evidence.v1')
+        names = collector.destination_names([folder, f])
+        self.assertEqual(names, {folder: 'evidence.v1', f: 'evidence_2.v1'})
+
+    def test_directory_suffix_keeps_dots_in_name(self):
+        first = os.path.join(self.root, 'a', 'case.2024')
+        second = os.path.join(self.root, 'b', 'case.2024')
+        self.path('a', 'case.2024', 'inner')
+        self.path('b', 'case.2024', 'inner')
+        names = collector.destination_names([first, second])
+        self.assertEqual(names[second], 'case.2024_2')
+
+    def test_suffix_skips_names_already_selected(self):
+        a = self.path('a', 'log')
+        b = self.path('b', 'log_2')
+        c = self.path('c', 'log')
+        names = collector.destination_names([a, b, c])
+        self.assertEqual(names[c], 'log_3')
+
+    def test_trailing_separator_is_ignored(self):
+        self.path('a', 'folder', 'inner')
+        folder = os.path.join(self.root, 'a', 'folder') + os.sep
+        self.assertEqual(collector.destination_names([folder])[folder], 'folder')
+
+
+class MapToSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.volume = os.path.realpath(tmp.name)
+        self.snapshot_info = {'volume': self.volume, 'mount_point': '/Volumes/ForensicSrc'}
+
+    def test_path_on_volume_maps_into_snapshot(self):
+        path = write_file(os.path.join(self.volume, 'Users', 'a', 'file.txt'), b'x')
+        self.assertEqual(collector.map_to_snapshot(path, self.snapshot_info),
+                         '/Volumes/ForensicSrc/Users/a/file.txt')
+
+    def test_volume_itself_maps_to_mount_point(self):
+        self.assertEqual(collector.map_to_snapshot(self.volume, self.snapshot_info),
+                         '/Volumes/ForensicSrc')
+
+    def test_symlinks_are_resolved_first(self):
+        target = write_file(os.path.join(self.volume, 'data', 'file.txt'), b'x')
+        link = os.path.join(self.volume, 'link.txt')
+        os.symlink(target, link)
+        self.assertEqual(collector.map_to_snapshot(link, self.snapshot_info),
+                         '/Volumes/ForensicSrc/data/file.txt')
+
+    def test_missing_path_is_returned_unchanged(self):
+        path = os.path.join(self.volume, 'missing')
+        self.assertEqual(collector.map_to_snapshot(path, self.snapshot_info), path)
+
+    def test_path_on_other_volume_is_returned_unchanged(self):
+        path = write_file(os.path.join(self.volume, 'file.txt'), b'x')
+        real_stat = os.stat
+
+        def stat(p, *args, **kwargs):
+            st = real_stat(p, *args, **kwargs)
+            if p == self.volume:
+                return os.stat_result((st.st_mode, st.st_ino, st.st_dev + 1) + tuple(st)[3:])
+            return st
+
+        with mock.patch.object(collector.os, 'stat', side_effect=stat):
+            self.assertEqual(collector.map_to_snapshot(path, self.snapshot_info), path)
+
+
+class TreeHashTest(unittest.TestCase):
+    SEGMENT_SIZE = 4096
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        for name, value in (('TREE_HASH_SEGMENT_SIZE', self.SEGMENT_SIZE),
+                            ('COPY_CHUNK_SIZE', 1024),
+                            ('PARALLEL_HASH_THRESHOLD', 2 * self.SEGMENT_SIZE)):
+            patcher = mock.patch.object(collector, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def expected(self, data):
+        """The documented tree hash: SHA-256 of the concatenated segment digests."""
+        segments = [data[i:i + self.SEGMENT_SIZE] for i in range(0, len(data), self.SEGMENT_SIZE)]
+        return hashlib.sha256(b''.join(hashlib.sha256(s).digest() for s in segments)).hexdigest()
+
+    def test_matches_tree_definition(self):
+        for size in (self.SEGMENT_SIZE, 5 * self.SEGMENT_SIZE + 123):
+            data = os.urandom(size)
+            path = write_file(os.path.join(self.root, f'file{size}'), data)
+            for nocache_threshold in (None, 0):
+                self.assertEqual(
+                    collector.calculate_hash_parallel(path, 'sha256', 3, nocache_threshold),
+                    self.expected(data))
+
+    def test_copy_and_hash_uses_same_mode_as_hash_pass(self):
+        data = os.urandom(3 * self.SEGMENT_SIZE + 7)
+        source = write_file(os.path.join(self.root, 'disk.dmg'), data)
+        destination = os.path.join(self.root, 'copy.dmg')
+        hexdigest, hash_mode = collector.copy_and_hash(source, destination, 'sha256')
+        self.assertEqual(hash_mode, collector.get_hash_mode(len(data), 'sha256'))
+        self.assertNotEqual(hash_mode, 'standard')
+        self.assertEqual(hexdigest, self.expected(data))
+        self.assertEqual(hexdigest, collector.calculate_hash_parallel(source, 'sha256'))
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_small_files_use_standard_hash(self):
+        data = os.urandom(self.SEGMENT_SIZE)
+        source = write_file(os.path.join(self.root, 'small'), data)
+        hexdigest, hash_mode = collector.copy_and_hash(
+            source, os.path.join(self.root, 'small.copy'), 'sha256')
+        self.assertEqual((hexdigest, hash_mode), (hashlib.sha256(data).hexdigest(), 'standard'))
+
+
+class HashCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        for name, value in (('HASH_CACHE_PATH', os.path.join(self.root, 'cache.sqlite')),
+                            ('_hash_cache', None)):
+            patcher = mock.patch.object(collector, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: collector._hash_cache and collector._hash_cache.close())
+        self.path = write_file(os.path.join(self.root, 'file'), b'original')
+
+    def test_hit_when_stat_unchanged(self):
+        st = os.stat(self.path)
+        collector.store_cached_hash(self.path, 'sha256:standard', st, 'digest')
+        self.assertEqual(collector.get_cached_hash(self.path, 'sha256:standard', os.stat(self.path)),
+                         'digest')
+
+    def test_miss_for_other_algorithm_or_mode(self):
+        st = os.stat(self.path)
+        collector.store_cached_hash(self.path, 'sha256:standard', st, 'digest')
+        self.assertIsNone(collector.get_cached_hash(self.path, 'sha256:tree-64MiB', st))
+
+    def test_miss_when_file_changes(self):
+        st = os.stat(self.path)
+        collector.store_cached_hash(self.path, 'sha256:standard', st, 'digest')
+        with open(self.path, 'ab') as f:
+            f.write(b' changed')
+        self.assertIsNone(collector.get_cached_hash(self.path, 'sha256:standard', os.stat(self.path)))
+
+    def test_miss_when_only_mtime_changes(self):
+        st = os.stat(self.path)
+        collector.store_cached_hash(self.path, 'sha256:standard', st, 'digest')
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        self.assertIsNone(collector.get_cached_hash(self.path, 'sha256:standard', os.stat(self.path)))
+
+    def test_store_replaces_stale_entry(self):
+        collector.store_cached_hash(self.path, 'sha256:standard', os.stat(self.path), 'old')
+        with open(self.path, 'wb') as f:
+            f.write(b'new contents')
+        st = os.stat(self.path)
+        collector.store_cached_hash(self.path, 'sha256:standard', st, 'new')
+        self.assertEqual(collector.get_cached_hash(self.path, 'sha256:standard', st), 'new')
+
+
+if __name__ == '__main__':
+    unittest.main()